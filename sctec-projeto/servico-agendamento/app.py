@@ -1,17 +1,29 @@
 # app.py
 import os
-import uuid
+import base64
+import queue
+import random
+import threading
+import time
+import atexit
+import signal
+import json
 import hmac
 import hashlib
-import json
+import ssl
+import orjson
 import requests  
+from requests.adapters import HTTPAdapter
 from flask_cors import CORS
 from flask import send_from_directory
-from datetime import datetime
-from functools import wraps
+from datetime import datetime, timezone, timedelta
+from functools import lru_cache
 
-from flask import Flask, request, jsonify, g
+from flask import Flask, Response, request, jsonify, g, stream_with_context
+from flask.json.provider import JSONProvider
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import event, inspect
+from sqlalchemy.engine import Engine
 from sqlalchemy.exc import IntegrityError
 import logging
 from logging.handlers import RotatingFileHandler
@@ -22,16 +34,40 @@ DB_PATH = os.environ.get("SCTEC_DB_PATH", os.path.join(BASE_DIR, "sctec.db"))
 AUDIT_LOG_FILE = os.environ.get("SCTEC_AUDIT_LOG", os.path.join(BASE_DIR, "audit.log"))
 APP_LOG_FILE = os.environ.get("SCTEC_APP_LOG", os.path.join(BASE_DIR, "app.log"))
 AUDIT_HMAC_KEY = os.environ.get("SCTEC_AUDIT_KEY", "dev_audit_key_change_me")
+APP_LOG_LEVEL = os.environ.get("SCTEC_LOG_LEVEL", "INFO").upper()
 
 # 🔹 NOVO: URL do Coordenador
 # COORDENADOR_URL = os.environ.get("COORDENADOR_URL", "http://127.0.0.1:3000")
 
 COORDENADOR_URL = os.environ.get("COORDENADOR_URL", "http://coordenador:3000")
+# O INSERT ... WHERE NOT EXISTS já garante exclusão mútua no banco; com "0" o
+# agendamento não faz os dois round-trips HTTP de lock/unlock ao coordenador.
+USE_COORDENADOR = os.environ.get("SCTEC_USE_COORDENADOR", "1") != "0"
+
+class ORJSONProvider(JSONProvider):
+    """Serialização JSON do Flask (jsonify/get_json) via orjson"""
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
 
 # Flask + SQLAlchemy
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
 app.config["SQLALCHEMY_DATABASE_URI"] = f"sqlite:///{DB_PATH}?isolation_level=IMMEDIATE"
 app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+app.config["SQLALCHEMY_ENGINE_OPTIONS"] = {
+    "pool_size": 20,
+    "max_overflow": 40,
+    "pool_pre_ping": True,
+    # timeout: espera o lock do SQLite em vez de falhar na hora com "database is locked"
+    "connect_args": {"check_same_thread": False, "timeout": 30},
+}
 
 CORS(app, resources={
     r"/*": {
@@ -45,6 +81,17 @@ CORS(app, resources={
 
 db = SQLAlchemy(app)
 
+@event.listens_for(Engine, "connect")
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """WAL: leitores não bloqueiam o escritor (e vice-versa)"""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.close()
+
 # --- Models ---
 class Scientist(db.Model):
     __tablename__ = "scientists"
@@ -65,11 +112,20 @@ class Telescope(db.Model):
 
 class Booking(db.Model):
     __tablename__ = "bookings"
+    __table_args__ = (
+        # Índice composto para a checagem de sobreposição: igualdade em telescope_id/status,
+        # range em start_ms e end_ms lido do próprio índice (sem acessar a linha)
+        db.Index("ix_bookings_tel_status_start_end", "telescope_id", "status", "start_ms", "end_ms"),
+    )
     id = db.Column(db.Integer, primary_key=True)
     telescope_id = db.Column(db.String, db.ForeignKey("telescopes.id"), nullable=False)
     cientista_id = db.Column(db.Integer, db.ForeignKey("scientists.id"), nullable=False)
     start_utc = db.Column(db.String, nullable=False)
     end_utc = db.Column(db.String, nullable=False)
+    # Mesmo intervalo em epoch-ms (INTEGER): comparações e índice numéricos.
+    # start_utc/end_utc guardam o texto recebido, devolvido como está pela API.
+    start_ms = db.Column(db.BigInteger, nullable=True)
+    end_ms = db.Column(db.BigInteger, nullable=True)
     status = db.Column(db.String, default="CONFIRMED")
     request_timestamp_utc = db.Column(db.String, nullable=True)
     audit_log_ref = db.Column(db.String, nullable=True)
@@ -77,56 +133,338 @@ class Booking(db.Model):
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
 
 # --- Logging setup ---
+# O formato não usa thread: não coletar esses campos em cada LogRecord.
+# (logProcesses fica ligado: o log do gunicorn usa %(process)d; _srcfile também, pois o
+# handler padrão do Flask usa %(module)s)
+logging.logThreads = False
+logging.logMultiprocessing = False
+
 app_logger = logging.getLogger("sctec_app")
-app_logger.setLevel(logging.INFO)
+app_logger.setLevel(APP_LOG_LEVEL)
 formatter = logging.Formatter('%(levelname)s:%(asctime)s:%(name)s:%(message)s', "%Y-%m-%dT%H:%M:%S%z")
 
-file_handler = RotatingFileHandler(APP_LOG_FILE, maxBytes=5*1024*1024, backupCount=2)
-file_handler.setFormatter(formatter)
-app_logger.addHandler(file_handler)
+if os.environ.get("SCTEC_LOG_STDERR_ONLY") != "1":
+    # Processo único (python app.py): arquivo com rotação própria. Sob gunicorn vários workers
+    # rotacionariam o mesmo arquivo; lá o log vai só para stderr (rotação fica com o Docker).
+    file_handler = RotatingFileHandler(APP_LOG_FILE, maxBytes=5*1024*1024, backupCount=2)
+    file_handler.setFormatter(formatter)
+    app_logger.addHandler(file_handler)
 stream_handler = logging.StreamHandler()
 stream_handler.setFormatter(formatter)
 app_logger.addHandler(stream_handler)
 
 
-def overlaps(telescope_id, start_utc, end_utc):
-    """Verifica se há sobreposição de horários para o telescópio"""
-    existing = Booking.query.filter(
+def overlaps(telescope_id, start_ms, end_ms):
+    """Condição EXISTS: há reserva confirmada sobreposta ao intervalo [start_ms, end_ms)"""
+    # SELECT id (rowid): a consulta é respondida só pelo índice composto
+    return db.select(Booking.id).where(
         Booking.telescope_id == telescope_id,
         Booking.status == "CONFIRMED",
-        Booking.start_utc < end_utc,
-        Booking.end_utc > start_utc
-    ).first()
-    return existing is not None
+        Booking.start_ms < end_ms,
+        Booking.end_ms > start_ms
+    ).exists()
+
+# Serializa, dentro do processo, inserções concorrentes no mesmo telescópio antes de
+# chegarem ao lock do SQLite. Locks listrados: memória fixa para qualquer telescope_id.
+_TELESCOPE_LOCK_STRIPES = tuple(threading.Lock() for _ in range(64))
+
+def telescope_lock(telescope_id):
+    return _TELESCOPE_LOCK_STRIPES[hash(str(telescope_id)) % len(_TELESCOPE_LOCK_STRIPES)]
+
+def insert_booking_if_free(telescope_id, cientista_id, start_utc, end_utc, start_ms, end_ms,
+                           request_timestamp_utc, audit_log_ref):
+    """INSERT ... SELECT ... WHERE NOT EXISTS (sobreposição) num único statement.
+
+    A checagem e a escrita acontecem atomicamente dentro do SQLite, sem janela
+    entre o SELECT e o INSERT. Retorna o id criado ou None se houver conflito.
+    """
+    candidate = db.select(
+        db.literal(telescope_id),
+        db.literal(cientista_id),
+        db.literal(start_utc),
+        db.literal(end_utc),
+        db.literal(start_ms),
+        db.literal(end_ms),
+        db.literal("CONFIRMED"),
+        db.literal(request_timestamp_utc),
+        db.literal(audit_log_ref),
+    ).where(~overlaps(telescope_id, start_ms, end_ms))
+    stmt = db.insert(Booking).from_select(
+        ["telescope_id", "cientista_id", "start_utc", "end_utc", "start_ms", "end_ms",
+         "status", "request_timestamp_utc", "audit_log_ref"],
+        candidate
+    ).returning(Booking.id)
+    booking_id = db.session.execute(stmt).scalar()
+    db.session.commit()
+    return booking_id
 
 # --- Audit Log ---
+# As entradas vão para uma fila; uma thread em background assina e grava em lote
+# num fd mantido aberto, tirando assinatura e I/O do caminho da requisição.
+AUDIT_BATCH_MAX = 256  # abaixo do IOV_MAX (1024 no Linux)
+AUDIT_FLUSH_INTERVAL = 0.05  # segundos
+AUDIT_FSYNC_INTERVAL = 0.05  # segundos
+AUDIT_RETRY_INTERVAL = 1.0  # segundos entre tentativas de abrir o arquivo
+AUDIT_PENDING_MAX = 10000  # linhas retidas em memória enquanto o arquivo não abre
+
+# BLAKE2b keyed (sempre presente no hashlib); hmac-sha256 fica só para verificar entradas legadas
+AUDIT_SIG_SCHEME = "blake2b-256"
+
+_audit_queue = queue.SimpleQueue()
+_audit_writer_lock = threading.Lock()
+_audit_writer_pid = None
+_audit_reopen = threading.Event()
+
+def _write_all(fd, data):
+    view = memoryview(data)
+    while view:
+        view = view[os.write(fd, view):]
+
+def _write_lines(fd, lines):
+    """Um único writev() por lote (sem copiar as linhas num buffer); write() onde não existe"""
+    if not hasattr(os, "writev"):
+        _write_all(fd, b"".join(lines))
+        return
+    written = os.writev(fd, lines)
+    total = sum(len(line) for line in lines)
+    if written < total:
+        _write_all(fd, b"".join(lines)[written:])
+
+# fdatasync também persiste o novo tamanho do arquivo (append), mas pula o mtime; fsync onde não existe
+_sync_fd = getattr(os, "fdatasync", os.fsync)
+
+def _open_audit_fd():
+    return os.open(AUDIT_LOG_FILE, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+def _audit_writer_loop():
+    fd = None  # aberto sob demanda: falha ao abrir não derruba a thread, tenta de novo depois
+    pending = []  # linhas assinadas ainda não gravadas
+    dirty = False  # há dados gravados ainda sem fsync
+    last_sync = time.monotonic()
+    while True:
+        entries, waiters = [], []
+        if dirty:
+            # Com dados pendentes, acorda depois de AUDIT_FSYNC_INTERVAL mesmo sem novas entradas
+            timeout = AUDIT_FSYNC_INTERVAL
+        elif pending or _audit_reopen.is_set():
+            timeout = AUDIT_RETRY_INTERVAL
+        else:
+            timeout = None
+        try:
+            item = _audit_queue.get(timeout=timeout)
+        except queue.Empty:
+            item = None
+        deadline = time.monotonic() + AUDIT_FLUSH_INTERVAL
+        while item is not None:
+            if isinstance(item, threading.Event):
+                # flush_audit(): grava o que já chegou sem esperar o fim da janela
+                waiters.append(item)
+                break
+            entries.append(item)
+            if len(entries) >= AUDIT_BATCH_MAX:
+                break
+            try:
+                item = _audit_queue.get(timeout=max(0.0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+        pending.extend(_sign_batch(entries))
+        try:
+            if _audit_reopen.is_set():
+                # SIGHUP após rotação externa (logrotate): passa a gravar no arquivo novo.
+                # Abre o novo antes de fechar o atual: se a abertura falhar, segue no arquivo antigo
+                # (fechar antes deixaria fd apontando para um número que o processo pode reutilizar)
+                # e o evento continua setado para tentar de novo no próximo ciclo.
+                try:
+                    new_fd = _open_audit_fd()
+                except OSError as e:
+                    app_logger.error("Erro ao reabrir audit log: %s", e)
+                else:
+                    _audit_reopen.clear()
+                    old_fd, fd = fd, new_fd
+                    if old_fd is not None:
+                        try:
+                            if dirty:
+                                _sync_fd(old_fd)
+                        finally:
+                            dirty = False
+                            os.close(old_fd)
+            if fd is None:
+                fd = _open_audit_fd()
+            while pending:
+                # Retirado da fila antes de gravar: um erro de escrita não duplica linhas no retry
+                batch = pending[:AUDIT_BATCH_MAX]
+                del pending[:AUDIT_BATCH_MAX]
+                _write_lines(fd, batch)
+                dirty = True
+            # Um fsync por janela de AUDIT_FSYNC_INTERVAL, não por entrada
+            now = time.monotonic()
+            if dirty and (waiters or item is None or now - last_sync >= AUDIT_FSYNC_INTERVAL):
+                _sync_fd(fd)
+                dirty = False
+                last_sync = now
+        except OSError as e:
+            app_logger.error("Erro ao gravar audit log: %s", e)
+        if len(pending) > AUDIT_PENDING_MAX:
+            dropped = len(pending) - AUDIT_PENDING_MAX
+            del pending[:dropped]
+            app_logger.error("Audit log indisponível: %d entradas descartadas", dropped)
+        for w in waiters:
+            w.set()
+
+def _ensure_audit_writer():
+    """Inicia a thread de escrita uma vez por processo (seguro após fork)"""
+    global _audit_writer_pid
+    if _audit_writer_pid == os.getpid():
+        return
+    with _audit_writer_lock:
+        if _audit_writer_pid != os.getpid():
+            threading.Thread(target=_audit_writer_loop, name="audit-writer", daemon=True).start()
+            _audit_writer_pid = os.getpid()
+            app_logger.info("Audit writer iniciado: openssl=%s", ssl.OPENSSL_VERSION)
+
+def flush_audit(timeout=5):
+    """Bloqueia até que as entradas já enfileiradas estejam gravadas (e com fsync) no arquivo"""
+    if _audit_writer_pid != os.getpid():
+        return
+    done = threading.Event()
+    _audit_queue.put(done)
+    done.wait(timeout)
+
+atexit.register(flush_audit)
+
+def _request_audit_reopen(signum, frame):
+    _audit_reopen.set()
+
+def install_audit_reopen_handler():
+    """SIGHUP reabre o audit log (rotação externa).
+
+    Chamado na importação e de novo pelo gunicorn (post_worker_init), já que os workers
+    voltam o SIGHUP para SIG_DFL, que encerraria o worker.
+    """
+    if not hasattr(signal, "SIGHUP"):
+        return
+    try:
+        signal.signal(signal.SIGHUP, _request_audit_reopen)
+    except ValueError:
+        # Importado fora da thread principal: sem reabertura por sinal
+        pass
+
+install_audit_reopen_handler()
+
+# Estados já inicializados com a chave (bloco da chave / ipad+opad processados uma vez);
+# cada assinatura só faz copy() + update(payload)
+_AUDIT_KEY = AUDIT_HMAC_KEY.encode()
+_AUDIT_MAC_STATES = {
+    "blake2b-256": hashlib.blake2b(key=_AUDIT_KEY[:64], digest_size=32),
+    "hmac-sha256": hmac.new(_AUDIT_KEY, digestmod=hashlib.sha256),
+}
+
+def _audit_digest(scheme, payload: bytes):
+    state = _AUDIT_MAC_STATES.get(scheme)
+    if state is None:
+        return None
+    mac = state.copy()
+    mac.update(payload)
+    return mac.digest()
+
+def _sign_entry(entry):
+    payload = orjson.dumps(entry, option=orjson.OPT_SORT_KEYS)
+    entry["signature"] = f"{AUDIT_SIG_SCHEME}:{_audit_digest(AUDIT_SIG_SCHEME, payload).hex()}"
+    return orjson.dumps(entry) + b"\n"
+
+def _sign_batch(entries):
+    """Assina um lote de entradas e devolve as linhas JSONL prontas para gravar.
+
+    Uma entrada que não serializa é descartada sozinha (e registrada), sem perder o resto do lote.
+    """
+    lines = []
+    for entry in entries:
+        try:
+            lines.append(_sign_entry(entry))
+        except TypeError as e:
+            app_logger.error("Entrada de audit descartada audit_id=%s event_type=%s: %s",
+                             entry.get("id"), entry.get("event_type"), e)
+    return lines
+
 def write_audit_log(entry: dict):
     if "id" not in entry:
-        entry["id"] = str(uuid.uuid4())
+        entry["id"] = new_audit_id()
     if "timestamp_utc" not in entry:
-        entry["timestamp_utc"] = datetime.utcnow().isoformat() + "Z"
-    payload = json.dumps(entry, separators=(",", ":"), sort_keys=True, ensure_ascii=False)
-    sig = hmac.new(AUDIT_HMAC_KEY.encode(), payload.encode(), hashlib.sha256).digest()
-    entry["signature"] = "hmac-sha256:" + sig.hex()
-    with open(AUDIT_LOG_FILE, "a", encoding="utf-8") as f:
-        f.write(json.dumps(entry, ensure_ascii=False) + "\n")
-    app_logger.info(f"AUDIT:{entry.get('event_type')} request_id={entry.get('request_id')} audit_id={entry.get('id')}")
+        entry["timestamp_utc"] = now_rfc3339_ms()
+    _ensure_audit_writer()
+    _audit_queue.put(entry)
+    app_logger.info("AUDIT:%s request_id=%s audit_id=%s", entry.get('event_type'), entry.get('request_id'), entry.get('id'))
+
+def write_audit_log_sync(entries):
+    """Grava (com fsync) entradas de auditoria na hora, sem passar pela thread de escrita.
+
+    Usado na inicialização: init_db roda no master do gunicorn, que não deve iniciar o writer.
+    """
+    for entry in entries:
+        entry.setdefault("id", new_audit_id())
+        entry.setdefault("timestamp_utc", now_rfc3339_ms())
+    lines = [_sign_entry(entry) for entry in entries]
+    fd = _open_audit_fd()
+    try:
+        for i in range(0, len(lines), AUDIT_BATCH_MAX):
+            _write_lines(fd, lines[i:i + AUDIT_BATCH_MAX])
+        _sync_fd(fd)
+    finally:
+        os.close(fd)
+    for entry in entries:
+        app_logger.info("AUDIT:%s request_id=%s audit_id=%s", entry.get('event_type'), entry.get('request_id'), entry.get('id'))
+
+def verify_audit_signature(entry: dict):
+    """Confere a assinatura de uma entrada do audit log (aceita o formato legado hmac-sha256)"""
+    scheme, _, sig_hex = entry.get("signature", "").partition(":")
+    unsigned = {k: v for k, v in entry.items() if k != "signature"}
+    if scheme == "hmac-sha256":
+        # Entradas legadas foram assinadas sobre o json.dumps original, que difere do orjson
+        # em alguns valores (ex.: float 1e20 -> "1e+20" vs "1e20")
+        payload = json.dumps(unsigned, separators=(",", ":"), sort_keys=True, ensure_ascii=False).encode()
+    else:
+        payload = orjson.dumps(unsigned, option=orjson.OPT_SORT_KEYS)
+    expected = _audit_digest(scheme, payload)
+    if expected is None:
+        return False
+    return hmac.compare_digest(expected.hex(), sig_hex)
 
 # --- Helpers ---
+# Formatação por segundo fica em cache (maxsize=1): só os ms mudam entre chamadas
+@lru_cache(maxsize=1)
+def _utc_second_rfc3339(epoch_s):
+    return time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(epoch_s))
+
+@lru_cache(maxsize=1)
+def _utc_second_compact(epoch_s):
+    return time.strftime("%Y%m%d%H%M%S", time.gmtime(epoch_s))
+
+def now_pair():
+    """(RFC3339 com ms, epoch em ms) a partir de uma única leitura do relógio"""
+    ms = time.time_ns() // 1_000_000
+    return f"{_utc_second_rfc3339(ms // 1000)}.{ms % 1000:03d}Z", ms
+
 def now_rfc3339_ms():
-    return datetime.utcnow().isoformat(timespec="milliseconds") + "Z"
+    return now_pair()[0]
 
 def gen_request_id():
-    return f"req-{datetime.utcnow().strftime('%Y%m%d%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    return f"req-{_utc_second_compact(time.time_ns() // 1_000_000_000)}-{os.urandom(4).hex()}"
 
-def require_json(f):
-    @wraps(f)
-    def wrapper(*args, **kwargs):
-        if not request.is_json:
-            app_logger.info(f"BadRequest: non-json request path={request.path}")
-            return jsonify({"error":"BAD_REQUEST","message":"Content-Type must be application/json"}), 400
-        return f(*args, **kwargs)
-    return wrapper
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+def rfc3339_to_ms(value):
+    """RFC3339 (ex: 2025-12-01T03:00:00Z) -> epoch em ms; sem fuso é tratado como UTC.
+    Levanta ValueError se o valor não for um timestamp válido."""
+    if not isinstance(value, str):
+        raise ValueError(f"not a timestamp: {value!r}")
+    dt = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return (dt - _EPOCH) // timedelta(milliseconds=1)
+
+def new_audit_id():
+    """128 bits aleatórios em base64url (22 caracteres)"""
+    return base64.urlsafe_b64encode(os.urandom(16)).rstrip(b"=").decode()
 
 @app.before_request
 def attach_request_id():
@@ -134,35 +472,59 @@ def attach_request_id():
     g.remote_ip = request.remote_addr
 
 # --- NOVO: Funções para lock/unlock ---
-def acquire_lock(resource_id, owner_id="servico-agendamento-1", ttl_seconds=30):
-    """Tenta adquirir lock no coordenador"""
-    try:
-        response = requests.post(
-            f"{COORDENADOR_URL}/lock",
-            json={"resource": resource_id},
-            timeout=5
-        )
+# Sessão compartilhada: reaproveita conexões keep-alive com o coordenador
+_lock_session = requests.Session()
+_lock_adapter = HTTPAdapter(pool_connections=32, pool_maxsize=64, max_retries=0)
+_lock_session.mount("http://", _lock_adapter)
+_lock_session.mount("https://", _lock_adapter)
+_lock_session.headers.update({"Connection": "keep-alive"})
+
+def acquire_lock(resource_id, owner_id="servico-agendamento-1", ttl_seconds=30,
+                 attempts=4, base_delay=0.005, max_delay=0.05):
+    """Tenta adquirir lock no coordenador.
+
+    Em 409 (lock ocupado) tenta de novo com backoff exponencial com jitter
+    (5ms, 10ms, 20ms... até max_delay), liberando a thread em ~0.15s no pior caso.
+    """
+    for attempt in range(attempts):
+        try:
+            response = _lock_session.post(
+                f"{COORDENADOR_URL}/lock",
+                json={"resource": resource_id},
+                # Conexão curta (coordenador fora do ar falha rápido); leitura longa, porque
+                # desistir depois do envio pode deixar um lock concedido sem ninguém para liberar
+                timeout=(0.5, 5)
+            )
+        except requests.ReadTimeout as e:
+            # O pedido chegou ao coordenador e o lock pode ter sido concedido: o coordenador
+            # não tem TTL, então libera por precaução (a inserção atômica segue protegendo a agenda)
+            app_logger.error("Timeout ao adquirir lock: %s", e)
+            release_lock(resource_id)
+            return False
+        except Exception as e:
+            app_logger.error("Erro ao adquirir lock: %s", e)
+            return False
         if response.status_code == 200:
-            app_logger.info(f"Lock adquirido: {resource_id}")
+            app_logger.info("Lock adquirido: %s", resource_id)
             return True
-        else:
-            app_logger.warning(f"Lock negado: {resource_id}")
-            return False
-    except Exception as e:
-        app_logger.error(f"Erro ao adquirir lock: {e}")
-        return False
+        if response.status_code != 409:
+            break
+        if attempt < attempts - 1:
+            time.sleep(min(max_delay, base_delay * 2 ** attempt) * (0.5 + random.random()))
+    app_logger.warning("Lock negado: %s", resource_id)
+    return False
 
 def release_lock(resource_id):
     """Libera lock no coordenador"""
     try:
-        response = requests.post(
+        response = _lock_session.post(
             f"{COORDENADOR_URL}/unlock",
             json={"resource": resource_id},
             timeout=5
         )
-        app_logger.info(f"Lock liberado: {resource_id}")
+        app_logger.info("Lock liberado: %s", resource_id)
     except Exception as e:
-        app_logger.error(f"Erro ao liberar lock: {e}")
+        app_logger.error("Erro ao liberar lock: %s", e)
 
 # --- Rotas ---
 
@@ -177,24 +539,24 @@ def static_files(filename):
 @app.route("/time", methods=["GET"])
 def get_time():
     # 🔹 NOVO: Log de aplicação
-    app_logger.info(f"GET /time request_id={g.request_id} remote_ip={g.remote_ip}")
+    app_logger.info("GET /time request_id=%s remote_ip=%s", g.request_id, g.remote_ip)
     
-    server_time = now_rfc3339_ms()
+    server_time, server_ms = now_pair()
     
     return jsonify({
         "server_time_utc": server_time,
-        "server_unix_ms": int(datetime.utcnow().timestamp() * 1000)
+        "server_unix_ms": server_ms
     })
 
 # 🔹 NOVO: Endpoint de Cancelamento
 @app.route("/agendamentos/<int:booking_id>", methods=["DELETE"])
 def cancel_booking(booking_id):
     """Cancela um agendamento existente"""
-    app_logger.info(f"DELETE /agendamentos/{booking_id} request_id={g.request_id} remote_ip={g.remote_ip}")
+    app_logger.info("DELETE /agendamentos/%s request_id=%s remote_ip=%s", booking_id, g.request_id, g.remote_ip)
     
     booking = db.session.get(Booking, booking_id)
     if not booking:
-        app_logger.warning(f"Agendamento não encontrado: {booking_id}")
+        app_logger.warning("Agendamento não encontrado: %s", booking_id)
         return jsonify({
             "error": "NOT_FOUND",
             "message": f"Agendamento {booking_id} não encontrado"
@@ -236,7 +598,7 @@ def cancel_booking(booking_id):
     }
     write_audit_log(audit)
     
-    app_logger.info(f"Agendamento {booking_id} cancelado com sucesso")
+    app_logger.info("Agendamento %s cancelado com sucesso", booking_id)
     
     return jsonify({
         "message": "Agendamento cancelado com sucesso",
@@ -253,7 +615,7 @@ def cancel_booking(booking_id):
 @app.route("/agendamentos/<int:booking_id>", methods=["GET"])
 def get_booking(booking_id):
     """Retorna detalhes de um agendamento específico"""
-    app_logger.info(f"GET /agendamentos/{booking_id} request_id={g.request_id}")
+    app_logger.info("GET /agendamentos/%s request_id=%s", booking_id, g.request_id)
     
     # 🔹 CORRIGIDO: Usar db.session.get()
     booking = db.session.get(Booking, booking_id)
@@ -285,45 +647,72 @@ def get_booking(booking_id):
     
     return jsonify(response), 200
 
+_REQUIRED_BOOKING_FIELDS = ("telescope_id", "cientista_id", "start_utc", "end_utc", "request_timestamp_utc")
+_REQUIRED_BOOKING = frozenset(_REQUIRED_BOOKING_FIELDS)
+
 @app.route("/agendamentos", methods=["POST"])
-@require_json
-def create_booking():
-    payload = request.get_json()
-    app_logger.info(f"Requisição recebida para POST /agendamentos request_id={g.request_id}")
+def create_booking(_log=app_logger.info, _audit=write_audit_log, _now=now_rfc3339_ms, _jsonify=jsonify):
+    # Funções do caminho quente ligadas como argumentos padrão (LOAD_FAST em vez de busca em globals);
+    # o Flask passa só os view_args por nome, então esses padrões nunca são sobrescritos
+    # Content-Type checado aqui e corpo lido uma única vez (sem request.is_json/get_json)
+    # Tipo MIME sem parâmetros, sem diferenciar maiúsculas e ignorando espaços (como request.is_json)
+    ct = request.headers.get("Content-Type", "")
+    if ct.partition(";")[0].strip().lower() != "application/json":
+        _log("BadRequest: non-json request path=%s", request.path)
+        return _jsonify({"error":"BAD_REQUEST","message":"Content-Type must be application/json"}), 400
+    _log("Requisição recebida para POST /agendamentos request_id=%s", g.request_id)
+    received_at = _now()  # usado em todas as entradas de auditoria desta requisição
+    try:
+        payload = orjson.loads(request.get_data(cache=False))
+    except orjson.JSONDecodeError:
+        return _jsonify({"error":"BAD_REQUEST","message":"invalid JSON body"}), 400
+    if not isinstance(payload, dict):
+        return _jsonify({"error":"BAD_REQUEST","message":"JSON body must be an object"}), 400
     
     # Validação
-    required = ["telescope_id", "cientista_id", "start_utc", "end_utc", "request_timestamp_utc"]
-    for r in required:
-        if r not in payload:
-            return jsonify({"error":"BAD_REQUEST","message":f"missing {r}"}), 400
+    missing = _REQUIRED_BOOKING.difference(payload)
+    if missing:
+        first = next(r for r in _REQUIRED_BOOKING_FIELDS if r in missing)
+        return _jsonify({"error":"BAD_REQUEST","message":f"missing {first}"}), 400
     
     telescope_id = payload["telescope_id"]
     cientista_id = payload["cientista_id"]
     start_utc = payload["start_utc"]
     end_utc = payload["end_utc"]
+    try:
+        start_ms = rfc3339_to_ms(start_utc)
+        end_ms = rfc3339_to_ms(end_utc)
+    except ValueError:
+        return _jsonify({"error":"BAD_REQUEST","message":"start_utc/end_utc must be RFC3339 timestamps"}), 400
     
     # Criar resource_id único para o lock
     resource_id = f"{telescope_id}_{start_utc}"
     
     # 1. TENTAR ADQUIRIR LOCK
-    if not acquire_lock(resource_id):
+    if USE_COORDENADOR and not acquire_lock(resource_id):
         audit = {
-            "timestamp_utc": now_rfc3339_ms(),
+            "timestamp_utc": received_at,
             "level": "AUDIT",
             "event_type": "LOCK_CONFLICT",
             "service": "servico-agendamento",
             "request_id": g.request_id,
             "details": {"resource_id": resource_id, "reason": "LOCK_DENIED"}
         }
-        write_audit_log(audit)
-        return jsonify({"error":"RESOURCE_LOCKED","message":"Recurso está sendo acessado por outro processo"}), 409
+        _audit(audit)
+        return _jsonify({"error":"RESOURCE_LOCKED","message":"Recurso está sendo acessado por outro processo"}), 409
     
     try:
-        # 2. VERIFICAR CONFLITO
-        conflict = overlaps(telescope_id, start_utc, end_utc)
-        if conflict:
+        # 2. VERIFICAR CONFLITO E CRIAR BOOKING (atômico)
+        # O id da auditoria é gerado antes para que audit_log_ref entre no mesmo INSERT
+        audit_id = new_audit_id()
+        with telescope_lock(telescope_id):
+            booking_id = insert_booking_if_free(
+                telescope_id, cientista_id, start_utc, end_utc, start_ms, end_ms,
+                payload.get("request_timestamp_utc"), audit_id
+            )
+        if booking_id is None:
             audit = {
-                "timestamp_utc": now_rfc3339_ms(),
+                "timestamp_utc": received_at,
                 "level": "AUDIT",
                 "event_type": "AGENDAMENTO_RECUSADO",
                 "service": "servico-agendamento",
@@ -335,97 +724,183 @@ def create_booking():
                     "reason": "OVERLAP"
                 }
             }
-            write_audit_log(audit)
-            return jsonify({"error":"RESOURCE_CONFLICT","message":"Horário já reservado"}), 409
+            _audit(audit)
+            return _jsonify({"error":"RESOURCE_CONFLICT","message":"Horário já reservado"}), 409
         
-        # 3. CRIAR BOOKING
-        booking = Booking(
-            telescope_id=telescope_id,
-            cientista_id=cientista_id,
-            start_utc=start_utc,
-            end_utc=end_utc,
-            request_timestamp_utc=payload.get("request_timestamp_utc"),
-            status="CONFIRMED"
-        )
-        db.session.add(booking)
-        db.session.commit()
-        
-        # 4. AUDITAR
+        # 3. AUDITAR
         audit = {
-            "timestamp_utc": now_rfc3339_ms(),
+            "id": audit_id,
+            "timestamp_utc": received_at,
             "level": "AUDIT",
             "event_type": "AGENDAMENTO_CRIADO",
             "service": "servico-agendamento",
             "request_id": g.request_id,
             "details": {
-                "agendamento_id": booking.id,
+                "agendamento_id": booking_id,
                 "cientista_id": cientista_id,
                 "telescope_id": telescope_id,
                 "start_utc": start_utc,
                 "end_utc": end_utc
             }
         }
-        write_audit_log(audit)
+        _audit(audit)
         
-        return jsonify({
-            "id": booking.id,
-            "telescope_id": booking.telescope_id,
-            "start_utc": booking.start_utc,
-            "end_utc": booking.end_utc,
-            "status": booking.status,
+        return _jsonify({
+            "id": booking_id,
+            "telescope_id": telescope_id,
+            "start_utc": start_utc,
+            "end_utc": end_utc,
+            "status": "CONFIRMED",
             "links": [
-                {"rel":"self","href":f"/agendamentos/{booking.id}","method":"GET"},
-                {"rel":"cancel","href":f"/agendamentos/{booking.id}","method":"DELETE"}
+                {"rel":"self","href":f"/agendamentos/{booking_id}","method":"GET"},
+                {"rel":"cancel","href":f"/agendamentos/{booking_id}","method":"DELETE"}
             ]
         }), 201
     
     except IntegrityError:
         db.session.rollback()
         audit = {
-            "timestamp_utc": now_rfc3339_ms(),
+            "timestamp_utc": received_at,
             "level": "AUDIT",
             "event_type": "AGENDAMENTO_RECUSADO",
             "service": "servico-agendamento",
             "request_id": g.request_id,
             "details": {"reason": "CONCURRENCY_COMMIT_FAIL"}
         }
-        write_audit_log(audit)
-        return jsonify({"error":"RESOURCE_CONFLICT","message":"Conflito de concorrência"}), 409
+        _audit(audit)
+        return _jsonify({"error":"RESOURCE_CONFLICT","message":"Conflito de concorrência"}), 409
     
     finally:
-        # 5. LIBERAR LOCK (SEMPRE)
-        release_lock(resource_id)
+        # 4. LIBERAR LOCK (SEMPRE)
+        if USE_COORDENADOR:
+            release_lock(resource_id)
 
 # --- Demais rotas (sem alteração significativa) ---
+# Trechos constantes dos envelopes JSON, concatenados como bytes em vez de serializados a cada vez
+_TELE_TAIL = b',"links":[{"rel":"create_booking","href":"/agendamentos","method":"POST"}]}'
+_BOOKING_ITEM_TAIL = b',"links":[{"rel":"self","href":"/agendamentos/%d"}]}'
+_BOOKING_LIST_MIMETYPES = ["application/json", "application/x-ndjson"]
+
+# Cache do corpo de /telescopios (praticamente estático): (etag, body, cached_at) ou None.
+# Os eventos abaixo só veem escritas deste processo; o TTL cobre os demais workers.
+TELESCOPE_CACHE_TTL = 60  # segundos
+_tele_cache = {"entry": None}
+
+@event.listens_for(Telescope, "after_insert")
+@event.listens_for(Telescope, "after_update")
+@event.listens_for(Telescope, "after_delete")
+def invalidate_telescope_cache(mapper, connection, target):
+    _tele_cache["entry"] = None
+
 @app.route("/telescopios", methods=["GET"])
 def list_telescopes():
-    telescopes = Telescope.query.all()
-    out = [{"id": t.id, "nome": t.nome, "links": [{"rel": "self", "href": f"/telescopios/{t.id}"}]} for t in telescopes]
-    return jsonify({"telescopes": out, "links": [{"rel": "create_booking", "href": "/agendamentos", "method": "POST"}]})
+    entry = _tele_cache["entry"]
+    if entry is None or time.monotonic() - entry[2] >= TELESCOPE_CACHE_TTL:
+        telescopes = db.session.execute(db.select(Telescope.id, Telescope.nome))
+        out = [{"id": t.id, "nome": t.nome, "links": [{"rel": "self", "href": f"/telescopios/{t.id}"}]} for t in telescopes]
+        body = orjson.dumps({"telescopes": out})[:-1] + _TELE_TAIL
+        entry = (hashlib.blake2b(body, digest_size=8).hexdigest(), body, time.monotonic())
+        _tele_cache["entry"] = entry
+    etag, body, _ = entry
+    response = Response(body, mimetype="application/json")
+    response.set_etag(etag)
+    # If-None-Match igual ao ETag -> 304 sem corpo
+    return response.make_conditional(request)
 
 @app.route("/agendamentos", methods=["GET"])
 def list_bookings():
     telescope_id = request.args.get("telescopio")
-    q = Booking.query
+    # Core: tuplas de colunas, sem materializar objetos ORM; yield_per evita carregar tudo em memória
+    stmt = db.select(Booking.id, Booking.telescope_id, Booking.start_utc, Booking.end_utc, Booking.status)
     if telescope_id:
-        q = q.filter(Booking.telescope_id == telescope_id)
-    bookings = q.all()
-    out = []
-    for b in bookings:
-        out.append({
-            "id": b.id,
-            "telescope_id": b.telescope_id,
-            "start_utc": b.start_utc,
-            "end_utc": b.end_utc,
-            "status": b.status,
-            "links": [{"rel": "self", "href": f"/agendamentos/{b.id}"}]
-        })
-    return jsonify({"bookings": out})
-
-# Run
-if __name__ == "__main__":
+        stmt = stmt.where(Booking.telescope_id == telescope_id)
+    stmt = stmt.execution_options(yield_per=500)
+
+    def items():
+        for rows in db.session.execute(stmt).partitions():
+            yield [orjson.dumps({
+                "id": r.id,
+                "telescope_id": r.telescope_id,
+                "start_utc": r.start_utc,
+                "end_utc": r.end_utc,
+                "status": r.status
+            })[:-1] + _BOOKING_ITEM_TAIL % r.id for r in rows]
+
+    # Accept: application/x-ndjson -> um agendamento por linha; padrão continua {"bookings":[...]}
+    if request.accept_mimetypes.best_match(_BOOKING_LIST_MIMETYPES) == "application/x-ndjson":
+        def generate():
+            for chunk in items():
+                yield b"\n".join(chunk) + b"\n"
+        response = Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+        response.vary.add("Accept")  # o formato depende do Accept: caches não podem misturar
+        return response
+
+    def generate():
+        yield b'{"bookings":['
+        sep = b""
+        for chunk in items():
+            yield sep + b",".join(chunk)
+            sep = b","
+        yield b"]}"
+
+    response = Response(stream_with_context(generate()), mimetype="application/json")
+    response.vary.add("Accept")
+    return response
+
+# --- Inicialização ---
+def migrate_booking_epoch_columns():
+    """Adiciona start_ms/end_ms a bancos antigos e preenche a partir das strings RFC3339"""
+    columns = {c["name"] for c in inspect(db.engine).get_columns("bookings")}
+    with db.engine.begin() as conn:
+        for name in ("start_ms", "end_ms"):
+            if name not in columns:
+                conn.exec_driver_sql(f"ALTER TABLE bookings ADD COLUMN {name} BIGINT")
+        # Índices antigos, substituídos por ix_bookings_tel_status_start_end
+        conn.exec_driver_sql("DROP INDEX IF EXISTS ix_bookings_tel_range")
+        conn.exec_driver_sql("DROP INDEX IF EXISTS ix_bookings_tel_range_ms")
+        rows = conn.execute(
+            db.select(Booking.id, Booking.start_utc, Booking.end_utc, Booking.status)
+            .where((Booking.start_ms.is_(None)) | (Booking.end_ms.is_(None)))
+        ).all()
+        audits = []
+        request_id = gen_request_id()
+        for r in rows:
+            try:
+                values = {"start_ms": rfc3339_to_ms(r.start_utc), "end_ms": rfc3339_to_ms(r.end_utc)}
+            except ValueError:
+                # Sem start_ms/end_ms a reserva ficaria invisível para overlaps() mas ainda ativa:
+                # reservas vivas com horário ilegível são marcadas REJECTED (só uma vez)
+                if r.status in ("CONFIRMED", "PENDING"):
+                    conn.execute(db.update(Booking).where(Booking.id == r.id).values(status="REJECTED"))
+                    app_logger.warning("Agendamento %s com horário inválido: status %s -> REJECTED", r.id, r.status)
+                    audits.append({
+                        "level": "AUDIT",
+                        "event_type": "AGENDAMENTO_ATUALIZADO",
+                        "service": "servico-agendamento",
+                        "request_id": request_id,
+                        "details": {
+                            "agendamento_id": r.id,
+                            "start_utc": r.start_utc,
+                            "end_utc": r.end_utc,
+                            "old_status": r.status,
+                            "new_status": "REJECTED",
+                            "reason": "INVALID_TIME_MIGRATION"
+                        }
+                    })
+                continue
+            conn.execute(db.update(Booking).where(Booking.id == r.id).values(**values))
+        if audits:
+            # Gravado antes do commit: se a auditoria falhar, a migração é desfeita junto
+            write_audit_log_sync(audits)
+
+def init_db():
+    """Cria tabelas/índices e dados iniciais. Roda uma vez, antes de atender requisições."""
     with app.app_context():
         db.create_all()
+        migrate_booking_epoch_columns()
+        # Migração: create_all não cria índices novos em tabelas já existentes
+        for index in Booking.__table__.indexes:
+            index.create(db.engine, checkfirst=True)
         if not db.session.get(Telescope, "hubble-acad"):
             db.session.add(Telescope(id="hubble-acad", nome="Hubble Academic", descricao="Telescópio acadêmico"))
         
@@ -434,4 +909,7 @@ if __name__ == "__main__":
             db.session.add(Scientist(nome="Marie Curie", email="marie.curie@example.com", instituicao="Institut de Radiologie"))
         db.session.commit()
 
-    app.run(host="0.0.0.0", port=5000, debug=False, threaded=True)
\ No newline at end of file
+# Run (desenvolvimento; em produção: gunicorn -c gunicorn.conf.py app:app)
+if __name__ == "__main__":
+    init_db()
+    app.run(host="0.0.0.0", port=5000, debug=False, threaded=True)
@@ -0,0 +1,32 @@
+# gunicorn.conf.py
+# Uso: gunicorn -c gunicorn.conf.py app:app
+import multiprocessing
+import os
+
+bind = os.environ.get("GUNICORN_BIND", "0.0.0.0:5000")
+worker_class = "gthread"
+workers = int(os.environ.get("GUNICORN_WORKERS", multiprocessing.cpu_count()))
+threads = int(os.environ.get("GUNICORN_THREADS", 8))
+# Mantém conexões HTTP abertas entre requisições (padrão do gunicorn é 2s)
+keepalive = int(os.environ.get("GUNICORN_KEEPALIVE", 30))
+# Os workers não compartilham um RotatingFileHandler: log da aplicação só em stderr
+# (rotação pelo driver de log do Docker). Definido aqui porque app.py é importado no master
+# (on_starting), antes do fork.
+os.environ.setdefault("SCTEC_LOG_STDERR_ONLY", "1")
+
+
+def on_starting(server):
+    """Cria o schema e os dados iniciais uma única vez, no master, antes do fork dos workers"""
+    from app import app, db, init_db
+
+    init_db()
+    # Não herdar conexões SQLite abertas no master pelos workers
+    with app.app_context():
+        db.engine.dispose()
+
+
+def post_worker_init(worker):
+    """SIGHUP no worker reabre o audit log (o gunicorn reseta o sinal para SIG_DFL no worker)"""
+    from app import install_audit_reopen_handler
+
+    install_audit_reopen_handler()
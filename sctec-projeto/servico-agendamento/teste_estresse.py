@@ -1,5 +1,7 @@
 # teste_estresse.py
 import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
 import threading
 import time
 
@@ -15,21 +17,24 @@ PAYLOAD_CONFLITANTE = {
     "purpose": "Observação da Nebulosa X"
 }
 
+# Uma sessão para todas as threads: conexões reaproveitadas em vez de um socket novo por requisição
+session = requests.Session()
+session.mount("http://", HTTPAdapter(pool_connections=1, pool_maxsize=NUMERO_DE_REQUISICOES))
+
 def fazer_requisicao_agendamento(thread_num):
     print(f"[Thread {thread_num}]: Iniciando requisição...")
     try:
-        response = requests.post(URL_AGENDAMENTO, json=PAYLOAD_CONFLITANTE, timeout=10)
+        response = session.post(URL_AGENDAMENTO, json=PAYLOAD_CONFLITANTE, timeout=10)
         print(f"[Thread {thread_num}]: Status Code: {response.status_code}, Body: {response.text[:200]}")
     except requests.exceptions.RequestException as e:
         print(f"[Thread {thread_num}]: Erro: {e}")
 
 if __name__ == "__main__":
-    threads = []
-    start_time = time.time()
-    for i in range(NUMERO_DE_REQUISICOES):
-        t = threading.Thread(target=fazer_requisicao_agendamento, args=(i+1,))
-        threads.append(t)
-        t.start()
-    for t in threads:
-        t.join()
-    print("Terminado. Tempo total: %.2f s" % (time.time() - start_time))
+    with ThreadPoolExecutor(max_workers=NUMERO_DE_REQUISICOES) as executor:
+        # O executor cria as threads sob demanda; a barreira obriga todas a existirem
+        # antes de começar a medição, para que só as requisições entrem no tempo total
+        barreira = threading.Barrier(NUMERO_DE_REQUISICOES)
+        list(executor.map(lambda _: barreira.wait(), range(NUMERO_DE_REQUISICOES)))
+        start_time = time.time()
+        list(executor.map(fazer_requisicao_agendamento, range(1, NUMERO_DE_REQUISICOES + 1)))
+        print("Terminado. Tempo total: %.2f s" % (time.time() - start_time))